@@ -1,35 +1,65 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from escpos.escpos import Escpos
 from escpos.printer import Usb
-from escpos.exceptions import USBNotFoundError
-import barcode
-from barcode.writer import ImageWriter
-from io import BytesIO
-from PIL import Image
-import qrcode
+from escpos.exceptions import DeviceNotFoundError, USBNotFoundError
+from escpos.constants import CODEPAGE_CHANGE
+import usb.core
 import platform
 import os
 import logging
+import logging.handlers
+import functools
+import hmac
+import queue
+import threading
+import uuid
+from collections import deque
 from datetime import datetime
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from waitress import serve
+import orjson
 
 # Load environment variables from .env file
 load_dotenv()
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
-# Configure logging
+# Configure logging - records are queued and written to the file by a
+# background listener so request threads never block on disk I/O
+_LOG_QUEUE = queue.Queue(-1)
+# The QueueHandler formats each record once; the file handler writes it as-is
+_LOG_LISTENER = logging.handlers.QueueListener(_LOG_QUEUE, logging.FileHandler('printer_service.log'))
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='printer_service.log'
+    handlers=[logging.handlers.QueueHandler(_LOG_QUEUE)]
 )
+_LOG_LISTENER.start()
+atexit.register(_LOG_LISTENER.stop)
 logger = logging.getLogger(__name__)
 
 # Configuration - Now using environment variables
 CONFIG = {
     'port': int(os.getenv('PRINTER_PORT', 5001)),
     'auth_token': os.getenv('AUTH_TOKEN', 'your-secret-token-here'),
+    'auth_required': os.getenv('AUTH_REQUIRED', '1').strip() != '0',
     'printer_vendors': [
         {'idVendor': 0x0483, 'idProduct': 0x5743},  # Bixolon
         {'idVendor': 0x04b8, 'idProduct': 0x0202},  # Epson
@@ -44,42 +74,122 @@ CONFIG = {
     }
 }
 
+# Invoice text that never changes, pre-encoded for the printer
+TERMS = [
+    "* NO REFUND.",
+    "* Returns accepted within 7 days with receipt.",
+    "* No Product Will Be Replaced Without Bill.",
+    "* Please Check Your Bill Before Leaving The Shop."
+]
+DIVIDER = b"-" * 32 + b"\n"
+TERMS_BYTES = b"".join((term + "\n").encode("cp437") for term in TERMS)
+FOOTER_BYTES = b"ENJOY FROM EVERYWHERE\nTHANK YOU FOR WATCHING!\n"
+ITEMS_HEADER = ("%-20s%4s%8s%8s\n" % ("Item", "Qty", "Price", "Total")).encode("cp437")
+
+# Item table rows: name, quantity, price, line total / wrapped name overflow
+_ITEM_FMT = "%-20s%4.2f%8.2f%8.2f\n"
+_CONT_FMT = "%-20s\n"
+# Totals rows: label, amount
+_TOTAL_FMT = "%-20s%12.2f\n"
+
+# Expected Authorization header, built once
+_EXPECTED_TOKEN = f"Bearer {CONFIG['auth_token']}".encode()
+
 def validate_token():
     """Validate authentication token"""
-    auth_header = request.headers.get('Authorization')
-    expected_token = f"Bearer {CONFIG['auth_token']}"
+    if not CONFIG['auth_required']:
+        return True
     
-    # Debug logging
-    logger.debug(f"Expected token: {expected_token}")
-    logger.debug(f"Received token: {auth_header}")
+    auth_header = request.headers.get('Authorization')
     
-    if not auth_header or auth_header != expected_token:
-        logger.warning(f"Unauthorized access attempt. Expected: {expected_token}, Got: {auth_header}")
+    if not auth_header or not hmac.compare_digest(auth_header.encode(), _EXPECTED_TOKEN):
+        logger.warning(f"Unauthorized access attempt from {request.remote_addr}")
         return False
     return True
 
+class BufferedEscpos(Escpos):
+    """Collect ESC/POS commands in memory instead of sending them to a printer"""
+
+    def __init__(self):
+        Escpos.__init__(self)
+        # Select codepage 0 (CP437), which text() encodes to
+        self._buffer = bytearray(CODEPAGE_CHANGE + b"\x00")
+
+    def _raw(self, msg):
+        self._buffer += msg
+
+    def text(self, txt):
+        """Print text as CP437, skipping escpos' per-character codepage search"""
+        self._buffer += str(txt).encode("cp437", "replace")
+
+    @property
+    def output(self):
+        """All commands collected so far"""
+        return bytes(self._buffer)
+
+# Index of the vendor entry that matched last, tried first on the next scan
+_LAST_OK_IDX = 0
+
 def detect_printer():
     """Try to detect connected USB printer"""
-    for vendor in CONFIG['printer_vendors']:
+    global _LAST_OK_IDX
+    vendors = CONFIG['printer_vendors']
+    for idx in range(_LAST_OK_IDX, _LAST_OK_IDX + len(vendors)):
+        idx %= len(vendors)
+        vendor = vendors[idx]
         try:
             printer = Usb(vendor['idVendor'], vendor['idProduct'])
+            # Usb opens lazily; open now so a missing device raises here
+            printer.open()
             logger.info(f"Found printer with vendor {vendor['idVendor']:04x}, product {vendor['idProduct']:04x}")
+            _LAST_OK_IDX = idx
             return printer
-        except USBNotFoundError:
+        except DeviceNotFoundError:
             continue
     
     raise USBNotFoundError("No supported USB printer found")
 
-def generate_barcode(invoice_number):
-    """Generate barcode image for invoice number"""
+# Long-lived printer handle, shared by all requests; guarded by _PRINTER_LOCK
+_PRINTER = None
+_PRINTER_LOCK = threading.Lock()
+
+def get_printer():
+    """Return the shared printer, detecting it on first use"""
+    global _PRINTER
+    if _PRINTER is None:
+        _PRINTER = detect_printer()
+    return _PRINTER
+
+def reset_printer():
+    """Close the shared printer so the next request detects it again"""
+    global _PRINTER
+    if _PRINTER is not None:
+        try:
+            _PRINTER.close()
+        except Exception as e:
+            logger.warning(f"Closing printer failed: {str(e)}")
+        _PRINTER = None
+
+atexit.register(reset_printer)
+
+def _to_mono(img):
+    """Threshold an image to 1-bit black and white"""
+    return img.convert("L").point(lambda p: 255 if p > 128 else 0, mode="1")
+
+@functools.lru_cache(maxsize=256)
+def _barcode_image(invoice_number):
+    """Render the Code128 barcode for an invoice number"""
+    import barcode
+    from barcode.writer import ImageWriter
+    
     code = barcode.get('code128', invoice_number, writer=ImageWriter())
-    buffer = BytesIO()
-    code.write(buffer)
-    buffer.seek(0)
-    return Image.open(buffer)
+    return _to_mono(code.render())
 
-def generate_qr_code(url):
-    """Generate QR code image for website URL"""
+@functools.lru_cache(maxsize=256)
+def _qr_image(url):
+    """Render the QR code for a URL"""
+    import qrcode
+    
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -88,117 +198,188 @@ def generate_qr_code(url):
     )
     qr.add_data(url)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    return Image.open(buffer)
+    return _to_mono(qr.make_image(fill_color="black", back_color="white").get_image())
+
+def generate_barcode(invoice_number):
+    """Generate barcode image for invoice number"""
+    return _barcode_image(invoice_number)
+
+def generate_qr_code(url):
+    """Generate QR code image for website URL"""
+    return _qr_image(url)
+
+# Renders the barcode and QR code while the invoice text is being built
+_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-render")
+
+def compose_invoice(data):
+    """Build the complete ESC/POS byte stream for an invoice"""
+    barcode_future = _POOL.submit(generate_barcode, data['invoice_number'])
+    qr_future = _POOL.submit(generate_qr_code, data.get('website_url', CONFIG['default_company']['website']))
+    
+    printer = BufferedEscpos()
+    
+    # Print header (centered and bold)
+    printer.set(align='center', bold=True)
+    printer.text(f"{data.get('company_name', CONFIG['default_company']['name'])}\n")
+    printer.set(bold=False)
+
+    # Print contact information
+    for number in data.get('phone_numbers', CONFIG['default_company']['phones']):
+        printer.text(f"{number}\n")
+
+    # Print address and GSTIN
+    printer.text(f"{data.get('address', CONFIG['default_company']['address'])}\n")
+    printer.text(f"GSTIN: {data.get('gstin', CONFIG['default_company']['gstin'])}\n")
+
+    # Divider line
+    printer._raw(DIVIDER)
+
+    # Print invoice info
+    printer.set(align='left')
+    printer.text(f"Invoice #: {data['invoice_number']}\n")
+    printer.text(f"Date: {data['invoice_date']}\n")
+    if data.get('invoice_time'):
+        printer.text(f"Time: {data['invoice_time']}\n")
+    printer.text(f"Customer: {data['customer_name']}\n")
+
+    # Divider line
+    printer._raw(DIVIDER)
+
+    # Print items table header
+    printer._raw(ITEMS_HEADER)
+
+    # Print items
+    for item in data['items']:
+        quantity, price = item['quantity'], item['price']
+        name = item['name']
+        name_parts = [name[i:i+20] for i in range(0, len(name), 20)] or ['']
+        printer.text(_ITEM_FMT % (name_parts[0], quantity, price, quantity * price))
+        for part in name_parts[1:]:
+            printer.text(_CONT_FMT % part)
+
+    # Divider line
+    printer._raw(DIVIDER)
+
+    # Print totals
+    printer.text(_TOTAL_FMT % ('Subtotal:', data['subtotal']))
+    printer.text(_TOTAL_FMT % ('Discount:', data.get('discount', 0.00)))
+    printer.set(bold=True)
+    printer.text(_TOTAL_FMT % ('GRAND TOTAL:', data['total']))
+    printer.set(bold=False)
+
+    # Divider line
+    printer._raw(DIVIDER)
+
+    # Print terms and conditions
+    printer._raw(TERMS_BYTES)
+
+    # Divider line
+    printer._raw(DIVIDER)
+
+    # Print invoice number again
+    printer.set(align='center')
+    printer.text(f"{data['invoice_number']}\n")
+
+    # Divider line
+    printer._raw(DIVIDER)
+
+    # Generate and print barcode
+    barcode_img = barcode_future.result()
+    printer.image(barcode_img, impl="bitImageColumn")
+    printer.text("\n")
+
+    # Generate and print QR code
+    qr_img = qr_future.result()
+    printer.image(qr_img, impl="bitImageColumn")
+    printer.text("\n")
+
+    # Print footer message
+    printer.set(align='center')
+    printer._raw(FOOTER_BYTES)
+
+    # Cut paper (if supported)
+    printer.cut()
+    
+    return printer.output
 
 def print_invoice(data):
     """Print invoice with barcode and QR code"""
     try:
-        printer = detect_printer()
-    except USBNotFoundError as e:
-        logger.error(f"Printer detection failed: {str(e)}")
-        return False, str(e)
-    
-    try:
-        # Print header (centered and bold)
-        printer.set(align='center', bold=True)
-        printer.text(f"{data.get('company_name', CONFIG['default_company']['name'])}\n")
-        printer.set(bold=False)
-        
-        # Print contact information
-        for number in data.get('phone_numbers', CONFIG['default_company']['phones']):
-            printer.text(f"{number}\n")
-        
-        # Print address and GSTIN
-        printer.text(f"{data.get('address', CONFIG['default_company']['address'])}\n")
-        printer.text(f"GSTIN: {data.get('gstin', CONFIG['default_company']['gstin'])}\n")
-        
-        # Divider line
-        printer.text("-" * 32 + "\n")
-        
-        # Print invoice info
-        printer.set(align='left')
-        printer.text(f"Invoice #: {data['invoice_number']}\n")
-        printer.text(f"Date: {data['invoice_date']}\n")
-        if data.get('invoice_time'):
-            printer.text(f"Time: {data['invoice_time']}\n")
-        printer.text(f"Customer: {data['customer_name']}\n")
-        
-        # Divider line
-        printer.text("-" * 32 + "\n")
-        
-        # Print items table header
-        printer.text(f"{'Item':<20}{'Qty':>4}{'Price':>8}{'Total':>8}\n")
-        
-        # Print items
-        for item in data['items']:
-            name_parts = [item['name'][i:i+20] for i in range(0, len(item['name']), 20)]
-            for i, part in enumerate(name_parts):
-                if i == 0:
-                    printer.text(f"{part:<20}{item['quantity']:>4.2f}{item['price']:>8.2f}{item['quantity'] * item['price']:>8.2f}\n")
-                else:
-                    printer.text(f"{part:<20}\n")
-        
-        # Divider line
-        printer.text("-" * 32 + "\n")
-        
-        # Print totals
-        printer.text(f"{'Subtotal:':<20}{data['subtotal']:>12.2f}\n")
-        printer.text(f"{'Discount:':<20}{data.get('discount', 0.00):>12.2f}\n")
-        printer.set(bold=True)
-        printer.text(f"{'GRAND TOTAL:':<20}{data['total']:>12.2f}\n")
-        printer.set(bold=False)
-        
-        # Divider line
-        printer.text("-" * 32 + "\n")
-        
-        # Print terms and conditions
-        terms = [
-            "* NO REFUND.",
-            "* Returns accepted within 7 days with receipt.",
-            "* No Product Will Be Replaced Without Bill.",
-            "* Please Check Your Bill Before Leaving The Shop."
-        ]
-        for term in terms:
-            printer.text(f"{term}\n")
-        
-        # Divider line
-        printer.text("-" * 32 + "\n")
-        
-        # Print invoice number again
-        printer.set(align='center')
-        printer.text(f"{data['invoice_number']}\n")
-        
-        # Divider line
-        printer.text("-" * 32 + "\n")
-        
-        # Generate and print barcode
-        barcode_img = generate_barcode(data['invoice_number'])
-        printer.image(barcode_img, impl="bitImageColumn")
-        printer.text("\n")
-        
-        # Generate and print QR code
-        qr_img = generate_qr_code(data.get('website_url', CONFIG['default_company']['website']))
-        printer.image(qr_img, impl="bitImageColumn")
-        printer.text("\n")
-        
-        # Print footer message
-        printer.set(align='center')
-        printer.text("ENJOY FROM EVERYWHERE\n")
-        printer.text("THANK YOU FOR WATCHING!\n")
-        
-        # Cut paper (if supported)
-        printer.cut()
-        
-        return True, "Invoice printed successfully"
+        payload = compose_invoice(data)
     except Exception as e:
         logger.error(f"Printing failed: {str(e)}")
         return False, str(e)
-    finally:
-        printer.close()
+    
+    with _PRINTER_LOCK:
+        try:
+            device = get_printer()
+        except USBNotFoundError as e:
+            logger.error(f"Printer detection failed: {str(e)}")
+            return False, str(e)
+    
+        try:
+            device._raw(payload)
+            return True, "Invoice printed successfully"
+        except Exception as e:
+            logger.error(f"Printing failed: {str(e)}")
+            reset_printer()
+            return False, str(e)
+
+# Print jobs are run one at a time by a single worker thread, which is the
+# only thread that writes to the printer
+_PRINT_QUEUE = queue.Queue()
+_PRINT_JOBS = {}
+# Finished job ids, oldest first; queued and printing jobs are never evicted
+_FINISHED_JOBS = deque()
+_PRINT_JOBS_LOCK = threading.Lock()
+_MAX_PRINT_JOBS = 100
+_WORKER = None
+
+def _set_job_status(job_id, status, message):
+    """Record the status of a print job, forgetting the oldest finished jobs"""
+    with _PRINT_JOBS_LOCK:
+        _PRINT_JOBS[job_id] = {"status": status, "message": message}
+        if status in ("printed", "failed"):
+            _FINISHED_JOBS.append(job_id)
+            while len(_FINISHED_JOBS) > _MAX_PRINT_JOBS:
+                del _PRINT_JOBS[_FINISHED_JOBS.popleft()]
+
+def get_job_status(job_id):
+    """Return the recorded status of a print job, or None if unknown"""
+    with _PRINT_JOBS_LOCK:
+        return _PRINT_JOBS.get(job_id)
+
+def _print_worker():
+    """Print queued invoices in the order they were received"""
+    while True:
+        job_id, data = _PRINT_QUEUE.get()
+        try:
+            _set_job_status(job_id, "printing", "Invoice is printing")
+            success, message = print_invoice(data)
+            _set_job_status(job_id, "printed" if success else "failed", message)
+        except Exception as e:
+            # Keep the only worker alive; fail just this job
+            logger.error(f"Print job {job_id} failed: {str(e)}")
+            _set_job_status(job_id, "failed", str(e))
+        finally:
+            _PRINT_QUEUE.task_done()
+
+def enqueue_print(data):
+    """Queue an invoice for printing and return its job id"""
+    global _WORKER
+    with _PRINT_JOBS_LOCK:
+        if _WORKER is None:
+            _WORKER = threading.Thread(target=_print_worker, name="print-worker", daemon=True)
+            _WORKER.start()
+    job_id = uuid.uuid4().hex
+    _set_job_status(job_id, "queued", "Invoice queued for printing")
+    _PRINT_QUEUE.put((job_id, data))
+    return job_id
+
+_REQUIRED_FIELDS = frozenset({
+    'invoice_number', 'invoice_date', 'customer_name',
+    'items', 'subtotal', 'total'
+})
 
 @app.route('/print', methods=['POST'])
 def handle_print():
@@ -210,18 +391,27 @@ def handle_print():
         return jsonify({"success": False, "message": "Request must be JSON"}), 400
     
     data = request.get_json()
-    required_fields = [
-        'invoice_number', 'invoice_date', 'customer_name',
-        'items', 'subtotal', 'total'
-    ]
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Request must be a JSON object"}), 400
+    
+    missing = _REQUIRED_FIELDS - data.keys()
+    if missing:
+        return jsonify({"success": False, "message": f"Missing required field: {', '.join(sorted(missing))}"}), 400
     
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"success": False, "message": f"Missing required field: {field}"}), 400
+    job_id = enqueue_print(data)
+    return jsonify({"success": True, "message": "Invoice queued for printing", "job_id": job_id}), 202
+
+@app.route('/print/<job_id>', methods=['GET'])
+def print_job_status(job_id):
+    """Endpoint to check the status of a queued print job"""
+    if not validate_token():
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
     
-    success, message = print_invoice(data)
-    status_code = 200 if success else 500
-    return jsonify({"success": success, "message": message}), status_code
+    job = get_job_status(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown print job"}), 404
+    
+    return jsonify({"success": job["status"] != "failed", "job_id": job_id, **job})
 
 @app.route('/status', methods=['GET'])
 def service_status():
@@ -229,28 +419,52 @@ def service_status():
     if not validate_token():
         return jsonify({"success": False, "message": "Unauthorized"}), 401
     
+    # A held lock means a job is using the printer; report that rather
+    # than waiting behind it
+    if not _PRINTER_LOCK.acquire(blocking=False):
+        return jsonify({
+            "success": True,
+            "message": "Printer is busy with a print job",
+            "system": platform.system(),
+            "printer": "Busy",
+            "queued": _PRINT_QUEUE.qsize()
+        })
+    
     try:
-        printer = detect_printer()
-        printer.close()
+        printer = get_printer()
+        # Enumerate without claiming, since the shared handle holds the interface
+        if usb.core.find(**printer.usb_args) is None:
+            raise USBNotFoundError("Printer disconnected")
         return jsonify({
             "success": True,
             "message": "Printer service is running",
             "system": platform.system(),
-            "printer": "Connected"
+            "printer": "Connected",
+            "queued": _PRINT_QUEUE.qsize()
         })
-    except USBNotFoundError as e:
+    except (USBNotFoundError, usb.core.USBError) as e:
+        # Drop the stale shared handle so the next job detects again
+        reset_printer()
         return jsonify({
             "success": False,
             "message": str(e),
             "system": platform.system(),
-            "printer": "Not connected"
+            "printer": "Not connected",
+            "queued": _PRINT_QUEUE.qsize()
         }), 503
+    finally:
+        _PRINTER_LOCK.release()
 
 def start_service():
-    """Start the Flask service"""
+    """Start the Flask service on the waitress WSGI server"""
     logger.info(f"Starting printer service on port {CONFIG['port']}")
-    logger.info(f"Using auth token: {CONFIG['auth_token']}")
-    app.run(host='127.0.0.1', port=CONFIG['port'], debug=False)
+    if CONFIG['auth_required']:
+        logger.info("Token authentication enabled")
+    else:
+        logger.warning("Authentication disabled (AUTH_REQUIRED=0)")
+    # Render the default website QR code now rather than on the first invoice
+    _qr_image(CONFIG['default_company']['website'])
+    serve(app, host='127.0.0.1', port=CONFIG['port'], threads=4)
 
 if __name__ == '__main__':
     start_service()
\ No newline at end of file